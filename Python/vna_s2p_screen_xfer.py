@@ -11,6 +11,7 @@ Matplotlib 3.4.x
 Tested on N5245B PNA-X
 """
 
+import sys
 import pyvisa
 import matplotlib.pyplot as plt
 
@@ -44,24 +45,32 @@ def vna_setup(vna, start=10e6, stop=26.5e9, numPoints=201, ifBw=1e3, measName=['
 
     vna.write('system:fpreset')
     vna.query('*opc?')
-    vna.write(f'display:window{win}:state on')
+
+    # The whole setup is built as a list of commands and sent as one compound message.
+    setupCmds = [f'display:window{win}:state on']
 
     # Order of operations: 1-Define a measurement. 2-Feed measurement to a trace on a window.
-    t = 1
-    for m, p in zip(measName, measParam):
-        vna.write(f'calculate{ch}:parameter:define "{m}","{p}"')
-        vna.write(f'display:window{win}:trace{t}:feed "{m}"')
-        t += 1
+    for t, (m, p) in enumerate(zip(measName, measParam), start=1):
+        setupCmds.append(f'calculate{ch}:parameter:define "{m}","{p}"')
+        setupCmds.append(f'display:window{win}:trace{t}:feed "{m}"')
 
     # Configure s-parameter stimulus
-    vna.write(f'sense{ch}:frequency:start {start}')
-    vna.write(f'sense{ch}:frequency:stop {stop}')
-    vna.write(f'sense{ch}:sweep:points {numPoints}')
-    vna.write(f'sense{ch}:bandwidth {ifBw}')
+    setupCmds.append(f'sense{ch}:frequency:start {start}')
+    setupCmds.append(f'sense{ch}:frequency:stop {stop}')
+    setupCmds.append(f'sense{ch}:sweep:points {numPoints}')
+    setupCmds.append(f'sense{ch}:bandwidth {ifBw}')
+
+    # Format data for transfer. This doesn't change for the rest of the session,
+    # so it's set once here rather than before every trace transfer.
+    setupCmds.append('format:border swap')
+    setupCmds.append('format real,64')  # Data type is double/float64, not int64.
+
+    vna.write(';'.join(f':{cmd}' for cmd in setupCmds))
 
 
 def vna_get_trace(vna, measName, ch):
-    """Acquires frequency and measurement data from selected measurement on VNA for plotting."""
+    """Acquires frequency and measurement data from selected measurement on VNA for plotting.
+    Expects the data format set by vna_setup() (swapped byte order, real,64)."""
     
     if not isinstance(measName, str):
         raise TypeError('measName must be a string.')
@@ -69,10 +78,6 @@ def vna_get_trace(vna, measName, ch):
     # Select measurement to be transferred.
     vna.write(f'calculate{ch}:parameter:select "{measName}"')
 
-    # Format data for transfer.
-    vna.write('format:border swap')
-    vna.write('format real,64')  # Data type is double/float64, not int64.
-
     # Acquire measurement data.
     meas = vna.query_binary_values(f'calculate{ch}:data? fdata', datatype='d')
     vna.query('*opc?')
@@ -84,19 +89,37 @@ def vna_get_trace(vna, measName, ch):
     return freq, meas
 
 
+def vna_transfer_file(vna, sourcePath, destPath, chunkSize=1024 * 1024):
+    """Transfers the file at sourcePath on the VNA to destPath on the remote PC.
+    The IEEE 488.2 binary block is streamed to disk in chunks so the whole file
+    is never held in memory."""
+
+    vna.write(f'mmemory:transfer? "{sourcePath}"')
+
+    # Binary block header is #<x><yyy>, where <x> is the number of digits in <yyy>
+    # and <yyy> is the number of bytes in the file
+    header = vna.read_bytes(2)
+    numBytes = int(vna.read_bytes(int(header[1:2])))
+
+    # Write file to remote PC file location as chunks arrive
+    with open(destPath, mode="wb") as f:
+        while numBytes:
+            chunk = vna.read_bytes(min(chunkSize, numBytes))
+            f.write(chunk)
+            numBytes -= len(chunk)
+
+    # Read the termination character that follows the binary block
+    vna.read_bytes(1)
+
+
 def vna_get_screenshot(vna, sourcePath, destPath):
     """Saves a screenshot (MUST BE IN .bmp FORMAT) at sourcePath on the VNA and transfers it to destPath on the remote PC"""
     
     # Save screenshot on VNA hard drive
     vna.write(f'mmemory:store "{sourcePath}"')
     
-    # Transfer raw bytes from file on VNA hard drive to remote PC
-    rawData = vna.query_binary_values(f'mmemory:transfer? "{sourcePath}"', datatype='c')
-    data = b''.join(rawData)
-
-    # Write file to remote PC file location
-    with open(destPath, mode="wb") as f:
-                f.write(data)
+    # Transfer file from VNA hard drive to remote PC
+    vna_transfer_file(vna, sourcePath, destPath)
 
 
 def vna_get_s2p(vna, sourcePath, destPath):
@@ -105,25 +128,42 @@ def vna_get_s2p(vna, sourcePath, destPath):
     # Save s2p file on VNA hard drive
     vna.write(f'mmemory:store "{sourcePath}"')    
     
-    # Transfer raw bytes from file on VNA hard drive to remote PC
-    rawData = vna.query_binary_values(f'mmemory:transfer? "{sourcePath}"', datatype='c')
-    data = b''.join(rawData)
+    # Transfer file from VNA hard drive to remote PC
+    vna_transfer_file(vna, sourcePath, destPath)
 
-    # Write file to remote PC file location
-    with open(destPath, mode="wb") as f:
-                f.write(data)
+
+def vna_enable_opc_srq(vna):
+    """Routes operation complete to a service request and enables VISA service request events."""
+
+    # *cls clears any event status left over from earlier commands, so a stale OPC can't raise
+    # the service request before the first *opc. *ese 1 routes OPC to the ESB bit of the
+    # status byte, *sre 32 routes ESB to SRQ
+    vna.write('*cls;*ese 1;*sre 32')
+    vna.enable_event(pyvisa.constants.EventType.service_request, pyvisa.constants.EventMechanism.queue)
+
+
+def vna_wait_opc(vna):
+    """Waits for pending operations to complete using a service request rather than
+    a blocking *opc? query. Requires vna_enable_opc_srq() to have been called."""
+
+    vna.write('*opc')
+    vna.wait_on_event(pyvisa.constants.EventType.service_request, vna.timeout)
+
+    # Reading the event status register clears OPC so the next *opc raises a new service request
+    vna.query('*esr?')
 
 
 def vna_single_trigger(vna):
     # Executes a single sweep and stops
     vna.write('initiate:continuous off')
     vna.write('initiate:immediate')
-    vna.query('*opc?')
+    vna_wait_opc(vna)
 
 
-def main():
+def main(headless=False):
     """Configures VNA to make a single sweep, acquiring all four 2-port
-    S parameters in separate traces and plots each in a separate subplot."""
+    S parameters in separate traces and plots each in a separate subplot.
+    If headless is True, the plot is saved to a file instead of displayed."""
 
     visaAddress = 'TCPIP0::127.0.0.1::hislip30::INSTR'
 
@@ -142,6 +182,7 @@ def main():
     measParam = ['S11', 'S12', 'S21', 'S22']
     
     vna_setup(vna, start=startFreq, stop=stopFreq, numPoints=numPoints, ifBw=ifBw, measName=measName, measParam=measParam, ch=ch, win=win)
+    vna_enable_opc_srq(vna)
 
     # Capture a single sweep
     vna_single_trigger(vna)
@@ -156,28 +197,38 @@ def main():
     destScreenFileName = 'C:\\temp\\screenshot_xfer.bmp'
     vna_get_screenshot(vna, sourceScreenFileName, destScreenFileName)
 
-    # Acquire and plot trace data.
+    # Acquire trace data
+    traces = [vna_get_trace(vna, m, ch=ch) for m in measName]
+
+    # Check for errors and gracefully disconnect before plotting
+    # so the VNA isn't held open while the plot window is up.
+    err_check(vna)
+    vna.close()
+
+    # Render to a file instead of a window when running headless
+    if headless:
+        plt.switch_backend('Agg')
+
+    # Plot trace data.
     plotColors = ['y', 'c', 'm', 'g']
     fig = plt.figure(figsize=(15, 8))
 
-    for t in range(len(measName)):
-        # Acquire trace data
-        freq, result = vna_get_trace(vna, measName[t], ch=ch)
+    for t, (freq, result) in enumerate(traces):
         # Add & format subplots and plot data
+        # Rasterizing the trace keeps drawing fast for traces with lots of points
         ax = fig.add_subplot(2, 2, t + 1, facecolor='k')
-        ax.plot(freq, result, c=plotColors[t])
+        ax.plot(freq, result, c=plotColors[t], rasterized=True)
         ax.set_title(f'Trace {t + 1}')
         ax.set_xlabel('Frequency (Hz)')
         ax.set_ylabel(f'{measParam[t]} (dB)')
 
-    # Clean up and display plots.
+    # Clean up and display or save plots.
     plt.tight_layout()
-    plt.show()
-
-    # Check for errors and gracefully disconnect.
-    err_check(vna)
-    vna.close()
+    if headless:
+        fig.savefig('C:\\temp\\traces.png', dpi=100)
+    else:
+        plt.show()
 
 
 if __name__ == '__main__':
-    main()
+    main(headless='--headless' in sys.argv)
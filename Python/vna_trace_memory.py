@@ -10,13 +10,14 @@ def add_memory_to_all_traces():
     vna = pyvisa.ResourceManager().open_resource('TCPIP0::127.0.0.1::hislip30::INSTR')
 
     # Get all the active channels on the VNA
+    # Catalog entries are only used to build SCPI commands, so they're kept as strings
     rawChannels = vna.query(f'system:channels:catalog?').strip('"\n')
-    channels = [int(w) for w in rawChannels.split(',')]
+    channels = rawChannels.split(',')
 
     # Iterate through channels, get all traces per channel, and save them to memory
     for ch in channels:
         rawTraces = vna.query(f'system:measure:catalog? {ch}').strip('"\n')
-        traces = [int(w) for w in rawTraces.split(',')]
+        traces = rawTraces.split(',')
 
         # Save traces to memory
         for t in traces:
@@ -24,12 +25,12 @@ def add_memory_to_all_traces():
 
     # Change display type to Data and Memory for all traces in each window
     rawWindows = vna.query(f'display:catalog?').strip('"\n')
-    windows = [int(w) for w in rawWindows.split(',')]
+    windows = rawWindows.split(',')
 
     # Iterate through windows
     for w in windows:
         rawWinTraces = vna.query(f'display:window{w}:catalog?').strip('"\n')
-        traces = [int(t) for t in rawWinTraces.split(',')]
+        traces = rawWinTraces.split(',')
         
         # Turn data and memory traces 
         for t in traces:
@@ -46,6 +46,9 @@ def main():
     vsa.write(f'ddemod:filter "{filterShape}"')
     vsa.write(f'ddemod:filter:abt {alpha}')
 
+    # Trace data format only needs to be set once for all trace transfers
+    vsa.write('format:trace:data real64')
+
     # Set up and execute a single-shot acquisition and measurement.
     vsa.write('initiate:continuous off')
     vsa.write('initiate:immediate')
@@ -61,10 +64,7 @@ def main():
         meas = vsa.query(f'trace4:data:table? {name}').strip()
         print(f'{name}: {meas}')
 
-    vsa.write('format:trace:data real64')
     evmVsTime = vsa.binblockread('trace3:data:y?', datatype='d').byteswap()
-
-    vsa.write('format:trace:data real64')
     i = vsa.binblockread('trace1:data:x?', datatype='d').byteswap()
     q = vsa.binblockread('trace1:data:y?', datatype='d').byteswap()
 
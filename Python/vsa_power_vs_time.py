@@ -55,24 +55,32 @@ def main():
     vsa.write('trace1:autoscale')
     vsa.write('trace1:y:scale:pdivision 2.5e-9')
 
-    for n in range(numTones):
-        vsa.write(f'trace1:marker{n + 1}:enable 1')
-        vsa.write(f'trace1:marker{n + 1}:x {fStart + toneSpacing * n}')
-        print(fStart + (toneSpacing * n))
-
+    # Enable and place one marker per tone in a single compound command
+    markerFreqs = [fStart + toneSpacing * n for n in range(numTones)]
+    markerCmds = []
+    for n, f in enumerate(markerFreqs):
+        markerCmds.append(f'trace1:marker{n + 1}:enable 1')
+        markerCmds.append(f'trace1:marker{n + 1}:x {f}')
+    vsa.write(';'.join(f':{cmd}' for cmd in markerCmds))
+    vsa.query('*opc?')
+    for f in markerFreqs:
+        print(f)
 
     vsa.write('initiate:continuous off')
     numAvg = 10
     gdAverage = np.zeros(numTones)
     gdStdDev = np.zeros(numTones)
     gdPtP = np.zeros(numTones)
-    gdRaw = np.zeros((numTones, numAvg))
+    gdRaw = np.empty((numTones, numAvg))
+
+    # Read all tone markers with one compound query. The responses come back
+    # separated by ';' and are parsed straight into a column of gdRaw.
+    markerQuery = ';'.join(f':trace:marker{n + 1}:y?' for n in range(numTones))
     for yikes in range(5):
         for i in range(numAvg):
             vsa.write('initiate:immediate')
             vsa.query('*opc?')
-            for n in range(numTones):
-                gdRaw[n][i] = float(vsa.query(f'trace:marker{n + 1}:y?'))
+            gdRaw[:, i] = np.array(vsa.query(markerQuery).split(';'), dtype=np.float64)
         for n in range(numTones):
             gdAverage[n] = np.mean(gdRaw[n])
             gdStdDev[n] = np.std(gdRaw[n])
@@ -2,11 +2,13 @@
 # Author: Morgan Allison
 # Updated: 11/2022
 
-import pyvisa
+from xsa_common import open_xsa, write_batch, get_idn
+import numpy as np
 
-def main():
-    """Establishes communication with X-series signal analyzer,
-    sets up an ACPR measurement, takes a measurement, and prints results."""
+def measure_acpr(xsa):
+    """Sets up an ACPR measurement on an open X-series signal analyzer session,
+    takes a measurement, prints results, and returns the raw result values.
+    Can be run on several analyzers at once with xsa_common.run_parallel()."""
 
     # User-configured variables
     acpMethod = 'ibw' # ibw, ibwrange, rbw
@@ -26,63 +28,48 @@ def main():
     altChOffset = 200e6
     altChBw = 100e6    
 
-    # This is a VISA resource manager object, use it to connect to your instrument
-    rm = pyvisa.ResourceManager()
-    # the string I used here was copied directly from Keysight Connection Expert
-    xsa = rm.open_resource('TCPIP0::192.168.4.59::hislip0::INSTR')
-    xsa.timeout = 10000
-
-    # Now I can interact with the spectrum analyzer object by calling
-    # .write(), .query(), .read(), etc. methods
-
     # Reset the instrument and wait for reset operation to complete
-    xsa.write('*RST')
+    xsa.query('*RST;*OPC?')
+
+    # Build the ACPR configuration as a list of commands and send it as a single compound message
+    cmds = [
+        # Select ACPR measurement
+        'configure:acpower',
+        'configure:acpower:ndefault',
+        # Configure basic ACPR parameters
+        f'acpower:method {acpMethod}',
+        f'acpower:average:count {avgNumber}',
+        # Configure main channel parameters
+        f'sense:frequency:center {mainChCf}',
+        f'acpower:carrier:list:bandwidth:integration {mainChBw}',
+        # Configure offset definitions (center-to-center)
+        'acpower:offset:outer:type ctocenter',
+        # Enable and configure adjacent and/or alternate channels
+        f'acpower:offset:list:state {adjChEnable},{altChEnable}',
+        f'acpower:offset:outer:list:frequency {adjChOffset}, {altChOffset}',
+        f'acpower:offset:outer:list:bandwidth:integration {adjChBw}, {altChBw}',
+    ]
+    write_batch(xsa, cmds)
     xsa.query('*OPC?')
 
-    # get instrument identifier
-    instID = xsa.query('*IDN?')
-    # I'm using an f-string here, which uses {var} to insert variables into strings
-    print(f'Connected to {instID}')
-
-    # Select ACPR measurement
-    xsa.write('configure:acpower')
-    xsa.write('configure:acpower:ndefault')
-    
-    # Configure basic ACPR parameters
-    xsa.write(f'acpower:method {acpMethod}')
-    xsa.write(f'acpower:average:count {avgNumber}')
-  
-    # Configure main channel parameters
-    xsa.write(f'sense:frequency:center {mainChCf}')
-    xsa.write(f'acpower:carrier:list:bandwidth:integration {mainChBw}')
-
-    # Configure offset definitions (center-to-center)
-    xsa.write('acpower:offset:outer:type ctocenter')
-
-    # Enable and configure adjacent and/or alternate channels
-    xsa.write(f'acpower:offset:list:state {adjChEnable},{altChEnable}')
-    xsa.write(f'acpower:offset:outer:list:frequency {adjChOffset}, {altChOffset}')
-    xsa.write(f'acpower:offset:outer:list:bandwidth:integration {adjChBw}, {altChBw}')
-
     # Make a single-shot measurement
     xsa.write('initiate:continuous off')
-    xsa.write('initiate:immediate')
-    xsa.query('*opc?')
+    xsa.query('initiate:immediate;*opc?')
 
     # Get and print results, which are returned as a string of comma separated values
     results = xsa.query('fetch:acpower1?')
-    results = results.split(',')
+    results = np.array(results.split(','), dtype=np.float64)
     
-    carrierPwrdBm = float(results[1])
-    referencePwrdBm = float(results[3])
-    lowerOffsetARelPwrdBm = float(results[4])
-    lowerOffsetAAbsPwrdBm = float(results[5])
-    upperOffsetARelPwrdBm = float(results[6])
-    upperOffsetAAbsPwrdBm = float(results[7])
-    lowerOffsetBRelPwrdBm = float(results[8])
-    lowerOffsetBAbsPwrdBm = float(results[9])
-    upperOffsetBRelPwrdBm = float(results[10])
-    upperOffsetBAbsPwrdBm = float(results[11])
+    carrierPwrdBm = results[1]
+    referencePwrdBm = results[3]
+    lowerOffsetARelPwrdBm = results[4]
+    lowerOffsetAAbsPwrdBm = results[5]
+    upperOffsetARelPwrdBm = results[6]
+    upperOffsetAAbsPwrdBm = results[7]
+    lowerOffsetBRelPwrdBm = results[8]
+    lowerOffsetBAbsPwrdBm = results[9]
+    upperOffsetBRelPwrdBm = results[10]
+    upperOffsetBAbsPwrdBm = results[11]
     
     print(f'Carrier Power/Reference Power: {carrierPwrdBm:.4f} dBm/{referencePwrdBm:.4f} dBm')
     print()
@@ -92,5 +79,28 @@ def main():
     print(f'Alternate channel absolute power: Lower = {lowerOffsetBAbsPwrdBm:.2f} dBm, Upper = {upperOffsetBAbsPwrdBm:.2f} dBm')
     print(f'Alternate channel relative power: Lower = {lowerOffsetBRelPwrdBm:.2f} dB, Upper = {upperOffsetBRelPwrdBm:.2f} dB')
 
+    return results
+
+
+def main():
+    """Establishes communication with X-series signal analyzer,
+    sets up an ACPR measurement, takes a measurement, and prints results."""
+
+    # open_xsa() reuses a single VISA resource manager and session for each address
+    # the string I used here was copied directly from Keysight Connection Expert
+    visaAddress = 'TCPIP0::192.168.4.59::hislip0::INSTR'
+    xsa = open_xsa(visaAddress, timeout=10000)
+
+    # Now I can interact with the spectrum analyzer object by calling
+    # .write(), .query(), .read(), etc. methods
+
+    # get instrument identifier, which is cached between runs by get_idn()
+    instID = get_idn(xsa)
+    # I'm using an f-string here, which uses {var} to insert variables into strings
+    print(f'Connected to {instID}')
+
+    measure_acpr(xsa)
+
+
 if __name__ == '__main__':
     main()
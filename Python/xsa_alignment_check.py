@@ -4,24 +4,21 @@
 # Tested on N9020B
 # PyVISA 1.12.x
 
-import pyvisa
-import time
+from xsa_common import open_xsa, close_xsa, set_and_read, poll_until
 
 # Create instrument object
 visaAddress = 'TCPIP0::192.168.50.200::hislip0::INSTR'
-rm = pyvisa.ResourceManager()
-xsa = rm.open_resource(visaAddress)
+xsa = open_xsa(visaAddress)
 
 # Set alignments to PARTIAL, which only runs critical alignment routines and prioritizes
 # throughput over amplitude accuracy. There is not a dramatic reduction in accuracy.
-xsa.write('calibration:auto partial')
-
-# Check alignment status
+# Then check alignment status. Both are sent in one message by set_and_read().
 # Bit 14 of the questionable calibration register indicates if Align now All is needed
 # Bit 12 of the questionable calibration register indicates if Align now RF is needed
-# We will check both
-alignAllNeeded = int(xsa.query('status:questionable:calibration:condition?')) & (1 << 14)
-alignRFNeeded = int(xsa.query('status:questionable:calibration:condition?')) & (1 << 12)
+# We will check both from a single read of the register
+calCondition = int(set_and_read(xsa, 'calibration:auto partial', 'status:questionable:calibration:condition?'))
+alignAllNeeded = calCondition & (1 << 14)
+alignRFNeeded = calCondition & (1 << 12)
 
 # alignAllNeeded and alignRFNeeded will either be 1 << 14/1 << 12 or 0
 # If either variable has a non-zero value, it means the respective bit in the status register is high
@@ -34,9 +31,14 @@ if alignAllNeeded != 0 or alignRFNeeded != 0:
 
     # Bit 0 of the operation status register is set to 1 while the instrument is calibrating/aligning.
     # So we can query the whole register, which is a 16 bit value and mask bit 0 to check cal/align status.
-    while int(xsa.query('status:operation:condition?')) & 1 == 1:
-        print('Still calibrating. Please stand by.')
-        time.sleep(10)
+    # The delay between checks starts at 1 sec and grows up to 30 sec, so a quick alignment is noticed right away.
+    def alignment_done():
+        if int(xsa.query('status:operation:condition?')) & 1 == 1:
+            print('Still calibrating. Please stand by.')
+            return False
+        return True
+
+    poll_until(alignment_done, initialDelay=1, maxDelay=30)
 
     # We can then check the calibration status register to see if there were any issues with the alignment
     calStatus = int(xsa.query('status:questionable:calibration:condition?'))
@@ -46,5 +48,4 @@ if alignAllNeeded != 0 or alignRFNeeded != 0:
 else:
     print('No alignments needed. Carry on.')
 
-xsa.close()
-del xsa
\ No newline at end of file
+close_xsa(visaAddress)
\ No newline at end of file
@@ -0,0 +1,277 @@
+# X-series Analyzer Common Helpers
+# Updated: 10/2026
+# Shared connection helpers for the xsa_*.py examples.
+# Creating a VISA resource manager loads the VISA library, which can take a
+# noticeable amount of time, so one resource manager and one session per
+# instrument address is reused for everything run in the same Python process.
+# Instrument identity (*IDN?) and installed options don't change while an instrument
+# is in use, so they are cached in memory and in a JSON file in the user's home
+# directory that expires after 24 hours. Call invalidate() after a firmware update
+# or after installing options.
+# PyVISA 1.12.x
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pyvisa
+
+_rm = None
+_sessions = {}
+
+_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.xsa_cache.json')
+_CACHE_TTL = 24 * 60 * 60  # sec
+# Serializes reading and writing the cache file between threads, see run_parallel()
+_cacheLock = threading.Lock()
+# *IDN? and options responses already looked up in this process, by address
+_idns = {}
+_options = {}
+
+
+def get_rm():
+    """Returns the shared VISA resource manager, creating it on first use."""
+
+    global _rm
+    if _rm is None:
+        _rm = pyvisa.ResourceManager()
+    return _rm
+
+
+def open_xsa(address, timeout=10000):
+    """Returns an open session to the X-series analyzer at address, reusing the
+    existing session if one has already been opened in this process.
+    timeout is in ms."""
+
+    xsa = _sessions.get(address)
+    if xsa is None:
+        xsa = _open_session(address)
+        _sessions[address] = xsa
+    xsa.timeout = timeout
+    return xsa
+
+
+def _open_session(address):
+    """Opens a new session to the instrument at address with the termination settings used by the examples."""
+
+    inst = get_rm().open_resource(address)
+    # Responses are terminated by the END indicator, so no read termination character is needed
+    inst.read_termination = None
+    inst.write_termination = '\n'
+    # Read large transfers (trace data, files) in 1 MB chunks rather than PyVISA's default 20 kB
+    inst.chunk_size = 1024 * 1024
+    return inst
+
+
+def close_xsa(address):
+    """Closes the session to the X-series analyzer at address, if one is open."""
+
+    xsa = _sessions.pop(address, None)
+    if xsa is not None:
+        xsa.close()
+
+
+def join_commands(cmds):
+    """Joins a list of SCPI commands or queries into a single compound program message.
+    Each command gets a leading ':' so its header path starts from the root rather than
+    from the path of the command before it. Common commands (*CLS, *SRE, etc.) don't use
+    the header path, so they are left as they are."""
+
+    return ';'.join(cmd if cmd.startswith('*') else ':' + cmd.lstrip(':') for cmd in cmds)
+
+
+def write_batch(inst, cmds):
+    """Sends a list of SCPI commands as a single compound program message, so the
+    whole list costs one write instead of one write per command."""
+
+    inst.write(join_commands(cmds))
+
+
+def _load_cache():
+    """Returns the contents of the identity cache file, or an empty cache if it doesn't exist or can't be read."""
+
+    try:
+        with open(_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    """Writes the identity cache file. The cache is written to a temporary file that then
+    replaces the old one, so a reader never sees a partly written file.
+    The cache is only an optimization, so if it can't be written it is skipped."""
+
+    tempPath = f'{_CACHE_PATH}.{os.getpid()}.tmp'
+    try:
+        with open(tempPath, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tempPath, _CACHE_PATH)
+    except OSError:
+        pass
+
+
+def _cached_entry(address):
+    """Returns the identity cache file entry for address, or an empty entry if it is missing or has expired."""
+
+    with _cacheLock:
+        entry = _load_cache().get(address, {})
+    if 'idn' in entry and time.time() - entry['timestamp'] < _CACHE_TTL:
+        return entry
+    return {}
+
+
+def get_idn(inst):
+    """Returns the *IDN? response of the open instrument session inst.
+    The response is cached and only queried again once the cache entry expires."""
+
+    address = inst.resource_name
+    if address in _idns:
+        return _idns[address]
+
+    entry = _cached_entry(address)
+    if 'idn' in entry:
+        idn = entry['idn']
+    else:
+        # The instrument is queried outside the cache lock so other threads aren't held up
+        idn = inst.query('*IDN?').strip()
+        # *IDN? returns <manufacturer>,<model>,<serial number>,<firmware version>
+        fields = idn.split(',')
+        firmware = fields[3] if len(fields) > 3 else ''
+
+        with _cacheLock:
+            cache = _load_cache()
+            entry = cache.get(address, {})
+            # When an expired entry is refreshed, options cached for a different firmware version may no longer be valid
+            if entry.get('firmware') != firmware:
+                entry = {}
+            entry.update(idn=idn, firmware=firmware, timestamp=time.time())
+            cache[address] = entry
+            _save_cache(cache)
+
+    _idns[address] = idn
+    return idn
+
+
+def get_options(inst):
+    """Returns the :SYSTem:OPTions? response of the open instrument session inst.
+    The response is cached alongside the *IDN? response and expires with it."""
+
+    address = inst.resource_name
+    if address in _options:
+        return _options[address]
+
+    # Refreshes the cache entry if it has expired or the firmware has changed
+    get_idn(inst)
+
+    options = _cached_entry(address).get('options')
+    if options is None:
+        options = inst.query(':SYSTem:OPTions?').strip()
+        with _cacheLock:
+            cache = _load_cache()
+            cache.setdefault(address, {})['options'] = options
+            _save_cache(cache)
+
+    _options[address] = options
+    return options
+
+
+def invalidate(inst):
+    """Clears the cached identity and options of the open instrument session inst.
+    Call this after a firmware update or after installing options."""
+
+    address = inst.resource_name
+    _idns.pop(address, None)
+    _options.pop(address, None)
+    with _cacheLock:
+        cache = _load_cache()
+        if cache.pop(address, None) is not None:
+            _save_cache(cache)
+
+
+def set_and_read(inst, writeCmd, queryCmd):
+    """Sends a setting command and a query as one compound message and returns the query response.
+    The setting is applied before the query is evaluated, so this costs one round trip instead of a write plus a query."""
+
+    return inst.query(join_commands([writeCmd, queryCmd]))
+
+
+def poll_until(condition, initialDelay=0.001, maxDelay=0.1, timeout=None):
+    """Calls condition() until it returns a true value, and returns that value.
+    The delay between calls starts at initialDelay and grows by 1.5x up to maxDelay (sec),
+    so fast events are caught quickly without flooding the instrument with queries during long waits.
+    Raises TimeoutError if condition() is still false after timeout (sec). None waits forever."""
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = initialDelay
+    while True:
+        result = condition()
+        if result:
+            return result
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f'Condition not met after {timeout} sec')
+        time.sleep(delay)
+        delay = min(delay * 1.5, maxDelay)
+
+
+def enable_opc_status(inst):
+    """Configures the status registers so operation complete sets the MSS bit of the status byte.
+    *CLS clears any event status left over from earlier commands, so a stale OPC can't end the first wait early.
+    *ESE 1 routes OPC to the ESB bit of the status byte and *SRE 32 routes ESB to MSS."""
+
+    inst.write('*CLS;*ESE 1;*SRE 32')
+
+
+def wait_for_opc(inst, initialDelay=0.001, maxDelay=0.1, timeout=60):
+    """Waits for all pending operations to complete by polling the status byte rather than
+    blocking on *OPC?, so operations longer than the VISA timeout don't need a timeout change.
+    The delay between polls starts at initialDelay and grows by 1.5x up to maxDelay.
+    Raises TimeoutError if the operations haven't completed after timeout (sec).
+    Requires enable_opc_status() to have been called."""
+
+    inst.write('*OPC')
+    # Bit 6 of the status byte is MSS
+    poll_until(lambda: int(inst.query('*STB?')) & (1 << 6), initialDelay, maxDelay, timeout)
+
+    # Reading the event status register clears OPC so the next wait starts from a clean state
+    inst.query('*ESR?')
+
+
+def save_worker(saveQueue, save, errors):
+    """Background writer thread target. Calls save(*item) for each tuple put on saveQueue
+    until it receives None. Errors raised while saving are added to errors rather than
+    ending the thread, so the writer keeps emptying the queue and an acquisition loop
+    putting items on a bounded queue never blocks on a full queue."""
+
+    while True:
+        item = saveQueue.get()
+        if item is None:
+            break
+        try:
+            save(*item)
+        except Exception as e:
+            errors.append(e)
+
+
+def run_parallel(tasks, timeout=10000):
+    """Runs tasks on several instruments at the same time and returns their results in task order.
+
+    tasks is a list of (address, function) tuples. Each function is called on its own thread
+    with a new session to the instrument at address, which is closed when the function returns.
+    PyVISA releases the GIL while waiting for the instrument, so the instruments work in parallel.
+    timeout is in ms."""
+
+    def run(address, func):
+        inst = _open_session(address)
+        inst.timeout = timeout
+        try:
+            return func(inst)
+        finally:
+            inst.close()
+
+    if not tasks:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+        futures = [pool.submit(run, address, func) for address, func in tasks]
+        return [future.result() for future in futures]
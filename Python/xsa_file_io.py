@@ -2,38 +2,45 @@
 # Author: Morgan Allison
 # Updated: 06/2022
 
-import pyvisa
+import re
+from xsa_common import open_xsa
 
 
 def err_check(inst):
     """HELPER FUNCTION
     Prints out all errors and clears error queue. Raises error with the info of the error encountered."""
 
-    err = []
-    cmd = 'SYST:ERR?'
+    # Read the whole error queue in one query.
+    # The response is a comma separated list of <code>,"<message>" pairs
+    raw = inst.query('SYST:ERR:ALL?').strip()
 
-    # Strip out extra characters
-    temp = inst.query(cmd).strip().replace('+', '').replace('-', '')
-    # Read all errors until none are left
-    while temp != '0,"No error"':
-        # Build list of errors
-        err.append(temp)
-        temp = inst.query('syst:err?').strip().replace('+', '').replace('-', '')
+    # Build list of errors, skipping the 0,"No error" entry
+    err = [f'{code},"{msg}"' for code, msg in re.findall(r'([+-]?\d+),"([^"]*)"', raw) if int(code) != 0]
     if err:
         raise ValueError(err)
 
 
-def read_file(inst, sourcePath, destPath):
-    """Transfers file at sourcePath on the instrument to destPath on the remote PC"""
-    
-    # Transfer data from file on instrument hard drive as a list of raw bytes
-    rawData = inst.query_binary_values(f'mmemory:data? "{sourcePath}"', datatype='c')
-    # Join the raw data into a single bytes object
-    data = b''.join(rawData)
+def read_file(inst, sourcePath, destPath, chunkSize=1024 * 1024):
+    """Transfers file at sourcePath on the instrument to destPath on the remote PC.
+    The IEEE 488.2 binary block is streamed to disk in chunks so the whole file
+    is never held in memory."""
 
-    # Write file to remote PC file location as bytes
+    inst.write(f'mmemory:data? "{sourcePath}"')
+
+    # Binary block header is #<x><yyy>, where <x> is the number of digits in <yyy>
+    # and <yyy> is the number of bytes in the file
+    header = inst.read_bytes(2)
+    numBytes = int(inst.read_bytes(int(header[1:2])))
+
+    # Write file to remote PC file location as chunks arrive
     with open(destPath, mode="wb") as f:
-                f.write(data)
+        while numBytes:
+            chunk = inst.read_bytes(min(chunkSize, numBytes))
+            f.write(chunk)
+            numBytes -= len(chunk)
+
+    # Read the termination character that follows the binary block
+    inst.read_bytes(1)
 
 
 def write_file(inst, sourcePath, destPath, overwrite=True):
@@ -54,11 +61,12 @@ def write_file(inst, sourcePath, destPath, overwrite=True):
             print(str(e))
 
     # Transfer binary data from file on remote PC to hard drive on the instrument
-    inst.write_binary_values(f'mmemory:data "{destPath}", ', data, datatype='b')
+    # Data is sent as unsigned bytes, and no termination character is added after the binary block
+    inst.write_binary_values(f'mmemory:data "{destPath}", ', data, datatype='B', termination='')
  
 
 def file_io_test():
-    inst = pyvisa.ResourceManager().open_resource('TCPIP0::192.168.50.200::hislip0::INSTR')
+    inst = open_xsa('TCPIP0::192.168.50.200::hislip0::INSTR')
 
     writeSourcePath = 'C:\\temp\\data_cable2.s2p'
     writeDestPath = 'C:\\temp\\data_cable2.s2p'
@@ -11,6 +11,7 @@
 
 
 import socketscpi
+import numpy as np
 import matplotlib.pyplot as plt
 
 def main():
@@ -30,8 +31,7 @@ def main():
     # .write(), .query(), .read(), etc. methods
 
     # Reset the instrument and wait for reset operation to complete
-    sa.write('*RST')
-    sa.query('*OPC?')
+    sa.query('*RST;*OPC?')
 
     # get instrument identifier
     instID = sa.query('*IDN?')
@@ -53,23 +53,24 @@ def main():
 
     # Single shot, restart, wait for operation to complete
     sa.write(':INITiate:CONTinuous 0')
-    sa.write(':INITiate:WAVeform')
-    sa.query('*OPC?')
+    sa.query(':INITiate:WAVeform;*OPC?')
 
     # Make sure binary formatting for trace data is correct (data type and endianness)
     sa.write(':FORMat:TRACe:DATA REAL,32')
     sa.write(':FORMat:BORDer SWAPped')
 
     # Grab trace data (expecting 32-bit big endian floating point data)
+    # binblockread returns a NumPy array built directly on the received buffer
     trace = sa.binblockread(f':FETCH:WAVeform0?', datatype='f')
 
-    # Separate out interleaved I and Q
-    i = trace[0::2]
-    q = trace[1::2]
+    # Interleaved I/Q pairs of 32-bit floats have the same memory layout as complex64,
+    # so the trace can be viewed as complex IQ data without copying or deinterleaving.
+    # Complex math like np.abs(iq) then runs in a single pass over the buffer.
+    iq = trace.view(np.complex64)
 
     # Plot I and Q
-    plt.plot(i)
-    plt.plot(q)
+    plt.plot(iq.real)
+    plt.plot(iq.imag)
     plt.show()
 
     sa.err_check()
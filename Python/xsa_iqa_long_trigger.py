@@ -19,12 +19,68 @@
 # pip install numpy
 
 
-import csv
 import pyvisa
 from datetime import datetime, timezone, timedelta
-from time import sleep
 import matplotlib.pyplot as plt
 import numpy as np
+import queue
+import threading
+from xsa_common import write_batch, join_commands, poll_until, save_worker
+
+# Commands sent on every acquisition are built once here instead of on every loop iteration
+INIT_CMD = ':INITiate:SPECtrum'
+# Envelope, spectrum, and metadata traces
+FETCH_QUERIES = (':FETCH:spectrum2?', ':FETCH:spectrum4?', ':FETCH:spectrum1?')
+# status:operation:condition bits
+WAITING_FOR_TRIGGER = 1 << 5
+SWEEPING = 1 << 3
+
+
+def fetch_blocks(inst, queries):
+    """Sends several binary block queries as one compound message and returns the
+    responses as a list of NumPy arrays of 32-bit little endian floats.
+
+    The responses come back as one message of IEEE 488.2 binary blocks separated by ';':
+    #<x><yyy><data>;#<x><yyy><data>..., where <x> is the number of digits in <yyy>
+    and <yyy> is the number of bytes in <data>."""
+
+    inst.write(join_commands(queries))
+    raw = inst.read_raw()
+
+    blocks = []
+    pos = 0
+    for _ in queries:
+        # Skip the separator between responses
+        if raw[pos:pos + 1] == b';':
+            pos += 1
+        numDigits = int(raw[pos + 1:pos + 2])
+        numBytes = int(raw[pos + 2:pos + 2 + numDigits])
+        start = pos + 2 + numDigits
+        blocks.append(np.frombuffer(raw, dtype='<f4', count=numBytes // 4, offset=start))
+        pos = start + numBytes
+
+    return blocks
+
+
+def save_csv(fullFileName, freq, spectrum, timeArray, envelope):
+    """Saves frequency, spectrum, time, and envelope data to a csv file."""
+
+    # The spectrum and envelope can have different lengths, so only save as many rows as the shortest column
+    numRows = min(len(freq), len(spectrum), len(timeArray), len(envelope))
+    data = np.column_stack((freq[:numRows], spectrum[:numRows], timeArray[:numRows], envelope[:numRows]))
+    np.savetxt(fullFileName, data, delimiter=',', header='Frequency (Hz),Spectrum (dBm),Time (sec),Envelope (dBm)',
+               comments='', fmt=['%.15g', '%.9g', '%.15g', '%.9g'])
+    print(f'Saved data at {fullFileName}')
+
+
+def wait_for_bit(inst, mask, state, initialDelay=0.001, maxDelay=0.1):
+    """Polls the status:operation:condition register until the bit(s) in mask are
+    set (state=True) or cleared (state=False). The delay between polls starts at
+    initialDelay and grows by 1.5x up to maxDelay, see poll_until()."""
+
+    poll_until(lambda: bool(int(inst.query('status:operation:condition?')) & mask) == state,
+               initialDelay, maxDelay)
+
 
 def main():
     # Create an instrument object with pyvisa and set the timeout
@@ -35,8 +91,7 @@ def main():
     # .write(), .query(), .read(), etc. methods
 
     # Reset the instrument and wait for reset operation to complete
-    sa.write('*RST')
-    sa.query('*OPC?')
+    sa.query('*RST;*OPC?')
 
     # get instrument identifier
     instID = sa.query('*IDN?')
@@ -61,110 +116,126 @@ def main():
     # PDT is permanently GMT-7 hr: YYYYMMdd_hh-mm-ss
     tz = timezone(offset=timedelta(hours=-7), name='pdt')
 
-    # Set up IQ Analyzer mode for a complex spectrum measurement
-    # The default shows both a spectrum trace and IQ vs time traces
-    sa.write(f':INSTrument:SELect BASIC')
-    sa.write(f':CONFigure:SPECtrum:NDEFault')
-    
-    # Set cf, rbw, if bandwidth (aka span), and turn off averaging
-    # Note that the acquisition time in this mode is determined by resolution bandwidth. Low RBW --> long acq time
-    sa.write(f':SENSe:FREQuency:CENTer {cf}')
-    sa.write(f':SENSe:SPECtrum:BANDwidth:RESolution {rbw}')
-    sa.write(f':SENSe:SPECtrum:BANDwidth:IF:SIZE {ifBw}')
-    sa.write(f':SENSe:SPECtrum:AVERage:STATe off')
-
-    # Set 
-    sa.write(f':DISPlay:SPECtrum:VIEW:WINDow2:TRACe:X:SCALe:PDIVision {xScale}')
-    sa.write(f':DISPlay:SPECtrum:VIEW:WINDow:TRACe:Y:SCALe:RLEVel {refLevel}')
-    
-    # Set RF burst trigger
-    sa.write(f':TRIGger:SEQuence:RFBurst:LEVel:TYPE ABSolute')
-    sa.write(f':TRIGger:SEQuence:RFBurst:LEVel:ABSolute {trigLevel}')
-    sa.write(f':TRIGger:SEQuence:RFBurst:DELay {trigDelay}')
-    sa.write(f':TRIGger:SEQuence:RFBurst:DELay:STATe on')
-    sa.write(f':SENSe:SPECtrum:TRIGger:SOURce RFBurst')
-
-    # Make sure binary formatting for trace data is correct (data type and endianness)
-    sa.write(':FORMat:TRACe:DATA REAL,32')
-    sa.write(':FORMat:BORDer SWAPped')
-
-    sa.write(':INITiate:CONTinuous 0')
-    
-    for i in range(numRepetitions):
-        # Single shot, start acquisition
-        sa.write(':INITiate:SPECtrum')
+    # The setup commands are collected in a list and sent as one compound message
+    setupCmds = [
+        # Set up IQ Analyzer mode for a complex spectrum measurement
+        # The default shows both a spectrum trace and IQ vs time traces
+        ':INSTrument:SELect BASIC',
+        ':CONFigure:SPECtrum:NDEFault',
+
+        # Set cf, rbw, if bandwidth (aka span), and turn off averaging
+        # Note that the acquisition time in this mode is determined by resolution bandwidth. Low RBW --> long acq time
+        f':SENSe:FREQuency:CENTer {cf}',
+        f':SENSe:SPECtrum:BANDwidth:RESolution {rbw}',
+        f':SENSe:SPECtrum:BANDwidth:IF:SIZE {ifBw}',
+        ':SENSe:SPECtrum:AVERage:STATe off',
+
+        # Set time and amplitude scales
+        f':DISPlay:SPECtrum:VIEW:WINDow2:TRACe:X:SCALe:PDIVision {xScale}',
+        f':DISPlay:SPECtrum:VIEW:WINDow:TRACe:Y:SCALe:RLEVel {refLevel}',
+
+        # Set RF burst trigger
+        ':TRIGger:SEQuence:RFBurst:LEVel:TYPE ABSolute',
+        f':TRIGger:SEQuence:RFBurst:LEVel:ABSolute {trigLevel}',
+        f':TRIGger:SEQuence:RFBurst:DELay {trigDelay}',
+        ':TRIGger:SEQuence:RFBurst:DELay:STATe on',
+        ':SENSe:SPECtrum:TRIGger:SOURce RFBurst',
+
+        # Make sure binary formatting for trace data is correct (data type and endianness)
+        ':FORMat:TRACe:DATA REAL,32',
+        ':FORMat:BORDer SWAPped',
+
+        ':INITiate:CONTinuous 0',
+    ]
+    write_batch(sa, setupCmds)
+    sa.query('*OPC?')
+
+    # Files are saved on a background writer thread while the next acquisition runs
+    # The queue holds at most a few traces, so if saving falls behind, the acquisition loop
+    # waits rather than piling up traces in memory
+    saveQueue = queue.Queue(maxsize=4)
+    saveErrors = []
+    writer = threading.Thread(target=save_worker, args=(saveQueue, save_csv, saveErrors), daemon=True)
+    writer.start()
+
+    # The writer is always told to stop and waited for, even if an acquisition fails,
+    # so every trace that was already fetched is saved
+    try:
+        for i in range(numRepetitions):
+            # Stop acquiring if saving has failed, since the remaining traces couldn't be saved either
+            if saveErrors:
+                break
+
+            # Single shot, start acquisition
+            sa.write(INIT_CMD)
 
         
-        # Poll the status:operation register to see if the instrument is waiting for trigger
-        triggered = 0
-        while triggered == 0:
-            triggered = int(sa.query('status:operation:condition?')) & (1 << 5)
-            sleep(0.01)
-            # print(f'triggered? {triggered}')
-
-        # Once the instrument receives a trigger
-        # Get current time
-        rawTimestamp = datetime.now(tz)
-        # Convert datetime object to formatted string
-        timestamp = rawTimestamp.strftime('%Y%m%d_%H-%M-%S')
-
-        # After the instrument is triggered, it still needs to complete an acquisition,
-        # so poll the "sweeping" bit until it turns off, then get trace data
-        sweeping = 1
-        while sweeping:
-            sweeping = int(sa.query('status:operation:condition?')) & (1 << 3)
-            sleep(0.01)
-            # print(f'sweeping? {sweeping}')
-
-        # Wait for acquisition to complete after receiving the trigger
-        # This in addition to polling the "sweeping" bit is belt + suspenders
-        sa.query('*opc?')
-
-        # Grab trace data (expecting 32-bit big endian floating point data)
-        envelope = sa.query_binary_values(f':FETCH:spectrum2?', datatype='f')
-        spectrum = sa.query_binary_values(f':FETCH:spectrum4?', datatype='f')
-        
-        # the "meta" variable contains metadata about the measurement that we will use
-        # to build time and frequency arrays for plotting/saving results
-        # Page 425 in https://www.keysight.com/zz/en/assets/9018-02190/user-manuals/9018-02190.pdf?success=true
-        meta = sa.query_binary_values(f':FETCH:spectrum1?', datatype='f')
+            # Poll the status:operation register to see if the instrument is waiting for trigger
+            wait_for_bit(sa, WAITING_FOR_TRIGGER, True)
+
+            # Once the instrument receives a trigger
+            # Get current time
+            rawTimestamp = datetime.now(tz)
+            # Convert datetime object to formatted string
+            timestamp = rawTimestamp.strftime('%Y%m%d_%H-%M-%S')
+
+            # After the instrument is triggered, it still needs to complete an acquisition,
+            # so poll the "sweeping" bit until it turns off, then get trace data
+            wait_for_bit(sa, SWEEPING, False)
+
+            # Wait for acquisition to complete after receiving the trigger
+            # This in addition to polling the "sweeping" bit is belt + suspenders
+            sa.query('*opc?')
+
+            # Grab trace data (expecting 32-bit little endian floating point data) with a single compound query
+            # the "meta" variable contains metadata about the measurement that we will use
+            # to build time and frequency arrays for plotting/saving results
+            # Page 425 in https://www.keysight.com/zz/en/assets/9018-02190/user-manuals/9018-02190.pdf?success=true
+            envelope, spectrum, meta = fetch_blocks(sa, FETCH_QUERIES)
+            # The metadata comes back as 32-bit floats, which can't hold a 5 GHz start frequency to 1 Hz,
+            # so the frequency and time arrays are built from 64-bit floats
+            meta = meta.astype(np.float64)
         
-        # Build frequency array from metadata
-        fftPoints = int(meta[2])
-        startFreq = meta[3]
-        freqSpacing = meta[4]
-
-        stopFreq = startFreq + (freqSpacing * fftPoints)
-        freq = np.linspace(startFreq, stopFreq, fftPoints)
-
-        # Build time array from metadata
-        timePoints = int(meta[5])
-        startTime = meta[6]
-        timeSpacing = meta[7]
-        stopTime = startTime + (timeSpacing * timePoints)
-
-        timeArray = np.linspace(startTime, stopTime, timePoints)
-
-        # # Print stuff
-        # print(f'fft points: {fftPoints}')
-        # print(f'first fft point: {startFreq}')
-        # print(f'fft point spacing: {freqSpacing}')
-
-        # # Plot stuff
-        # plt.subplot(2,1,1)
-        # plt.plot(timeArray, envelope)
-        # plt.subplot(2,1,2)
-        # plt.plot(freq, spectrum)
-        # plt.show()
-
-        # Save trace data to csv file
-        fullFileName = f'{baseFileName}{timestamp}.csv'
-        print(f'Saved data at {fullFileName}')
-        with open(fullFileName, 'w', newline='\n') as f:
-            writer = csv.writer(f, dialect='excel', delimiter=',', )
-            writer.writerow(['Frequency (Hz)', 'Spectrum (dBm)', 'Time (sec)', 'Envelope (dBm)'])
-            for f, s, t, e in zip(freq, spectrum, timeArray, envelope):
-                writer.writerow([f, s, t, e])
+            # Build frequency array from metadata
+            fftPoints = int(meta[2])
+            startFreq = meta[3]
+            freqSpacing = meta[4]
+
+            stopFreq = startFreq + (freqSpacing * fftPoints)
+            freq = np.linspace(startFreq, stopFreq, fftPoints)
+
+            # Build time array from metadata
+            timePoints = int(meta[5])
+            startTime = meta[6]
+            timeSpacing = meta[7]
+            stopTime = startTime + (timeSpacing * timePoints)
+
+            timeArray = np.linspace(startTime, stopTime, timePoints)
+
+            # # Print stuff
+            # print(f'fft points: {fftPoints}')
+            # print(f'first fft point: {startFreq}')
+            # print(f'fft point spacing: {freqSpacing}')
+
+            # # Plot stuff
+            # plt.subplot(2,1,1)
+            # plt.plot(timeArray, envelope)
+            # plt.subplot(2,1,2)
+            # plt.plot(freq, spectrum)
+            # plt.show()
+
+            # Save trace data to csv file in the background so the next acquisition can start right away
+            # Each fetch returns new arrays, so nothing saved here is modified by the next acquisition
+            fullFileName = f'{baseFileName}{timestamp}.csv'
+            saveQueue.put((fullFileName, freq, spectrum, timeArray, envelope))
+    finally:
+        # Tell the writer there are no more traces and wait for it to finish saving
+        saveQueue.put(None)
+        writer.join()
+
+    # Raise the first error that occurred while saving
+    if saveErrors:
+        raise saveErrors[0]
 
 
 if __name__ == '__main__':
@@ -10,13 +10,14 @@
 # pip install pyvisa
 # pip install numpy
 
-import pyvisa
+from xsa_common import open_xsa, get_idn, enable_opc_status, wait_for_opc, join_commands
 import numpy as np
 
-def main():
-    """Establishes communication with X-series signal analyzer,
-    configures basic settings, acquires a trace, and gathers
-    measurements by stepping a marker across the span of interest."""
+def marker_measurements(xsa):
+    """Configures basic settings on an open X-series signal analyzer session,
+    acquires a trace, and gathers measurements by stepping a marker across the
+    span of interest. Returns the marker frequencies and readings.
+    Can be run on several analyzers at once with xsa_common.run_parallel()."""
 
     # Measurement setup, not optimized for noise measurement right now
     cf = 2.4e9
@@ -25,22 +26,8 @@ def main():
     rbw = 10e3
     markerBw = 20e6
 
-    # This is a VISA resource manager object, use it to connect to your instrument
-    rm = pyvisa.ResourceManager()
-    # the string I used here was copied directly from Keysight Connection Expert
-    xsa = rm.open_resource('TCPIP0::141.121.199.82::hislip0::INSTR')
-
-    # Now I can interact with the spectrum analyzer object by calling
-    # .write(), .query(), .read(), etc. methods
-
     # Reset the instrument and wait for reset operation to complete
-    xsa.write('*RST')
-    xsa.query('*OPC?')
-
-    # get instrument identifier
-    instID = xsa.query('*IDN?')
-    # I'm using an f-string here, which uses {var} to insert variables into strings
-    print(f'Connected to {instID}')
+    xsa.query('*RST;*OPC?')
 
     # Set center frequency, span, rbw, and reference level
     xsa.write(f':SENSe:FREQuency:CENTer {cf}')
@@ -48,17 +35,12 @@ def main():
     xsa.write(f':SENSe:BANDwidth:RESolution {rbw}')
     xsa.write(f':DISPlay:WINDow:TRACe:Y:SCALe:RLEVel {refLevel}')
 
-    # Adjust timeout for long sweep
-    originalTimeout = xsa.timeout
-    xsa.timeout = 30
-
     # Single acquisition mode, start sweep, wait for operation to complete
+    # wait_for_opc() polls the status byte, so a long sweep doesn't need a longer timeout
+    enable_opc_status(xsa)
     xsa.write(':INITiate:CONTinuous 0')
     xsa.write(':INITiate:IMMediate')
-    xsa.query('*OPC?')
-
-    # Adjust timeout back to normal
-    xsa.timeout = originalTimeout
+    wait_for_opc(xsa)
 
     # Configure marker
     # Start with all markers off
@@ -77,22 +59,42 @@ def main():
     mkrFreqList = np.linspace(cf - (span / 2) + (markerBw / 2), cf + (span / 2) - (markerBw / 2), numMeasurements)
 
     # Measure marker values sequentially at frequency points specified above
-    mkrReadings = []
+    # Setting the marker and grabbing its value for every frequency point is sent as one
+    # compound message, so all the marker values come back in a single ';' separated response
+    mkrCmds = []
     for freq in mkrFreqList:
-        # Set marker to a given frequency
-        xsa.write(f':CALCulate:MARKer1:X {freq}')
-        # Grab marker value
-        mkrValue = float(xsa.query(':CALCulate:MARKer1:Y?'))
-        # Append marker value to list in dBm/Hz
-        mkrReadings.append(mkrValue)
-
-    # Format binary data for saving to a text file.
-    fileData = ''
-    for f, m in zip(mkrFreqList, mkrReadings):
-        fileData += f'{f}, {m}\n'
+        mkrCmds.append(f':CALCulate:MARKer1:X {freq}')
+        mkrCmds.append(':CALCulate:MARKer1:Y?')
+    mkrQuery = join_commands(mkrCmds)
+    # Marker values in dBm/Hz
+    mkrReadings = np.array(xsa.query(mkrQuery).split(';'), dtype=np.float64)
+
+    return mkrFreqList, mkrReadings
+
+
+def main():
+    """Establishes communication with X-series signal analyzer,
+    configures basic settings, acquires a trace, gathers measurements
+    by stepping a marker across the span of interest, and saves them."""
+
+    # open_xsa() reuses a single VISA resource manager and session for each address
+    # the string I used here was copied directly from Keysight Connection Expert
+    visaAddress = 'TCPIP0::141.121.199.82::hislip0::INSTR'
+    xsa = open_xsa(visaAddress)
+
+    # Now I can interact with the spectrum analyzer object by calling
+    # .write(), .query(), .read(), etc. methods
+
+    # get instrument identifier, which is cached between runs by get_idn()
+    instID = get_idn(xsa)
+    # I'm using an f-string here, which uses {var} to insert variables into strings
+    print(f'Connected to {instID}')
+
+    mkrFreqList, mkrReadings = marker_measurements(xsa)
+
     # Write marker x and y values to a text file
-    with open('C:\\temp\\mkr_results.txt', 'w+') as f:
-        f.write(fileData)
+    np.savetxt('C:\\temp\\mkr_results.txt', np.column_stack((mkrFreqList, mkrReadings)), fmt='%.15g', delimiter=', ')
+
 
 if __name__ == '__main__':
     main()
@@ -2,31 +2,34 @@
 # Author: Morgan Allison
 # Updated: 06/2022
 
-import pyvisa
+from xsa_common import open_xsa, get_idn, get_options, invalidate
 
 def main():
     """Establishes communication with X-series signal analyzer
     and prints out all installed options."""
 
-    # This is a VISA resource manager object, use it to connect to your instrument
-    rm = pyvisa.ResourceManager()
+    # open_xsa() reuses a single VISA resource manager and session for each address
     # the string I used here was copied directly from Keysight Connection Expert
-    xsa = rm.open_resource('TCPIP0::192.168.50.200::hislip0::INSTR')
+    visaAddress = 'TCPIP0::192.168.50.200::hislip0::INSTR'
+    xsa = open_xsa(visaAddress)
 
     # Now I can interact with the spectrum analyzer object by calling
     # .write(), .query(), .read(), etc. methods
 
     # Reset the instrument and wait for reset operation to complete
-    xsa.write('*RST')
-    xsa.query('*OPC?')
+    xsa.query('*RST;*OPC?')
+
+    # This script reports what is installed right now, so clear any cached identity and options first
+    # The fresh responses are cached again for the other examples
+    invalidate(xsa)
 
     # get instrument identifier
-    instID = xsa.query('*IDN?')
+    instID = get_idn(xsa)
     # I'm using an f-string here, which uses {var} to insert variables into strings
     print(f'Connected to {instID}')
 
     # Query, save, and print out all the options installed on the analyzer
-    optionString = xsa.query(":SYSTem:OPTions?")
+    optionString = get_options(xsa)
     print(optionString)
 
 if __name__ == '__main__':
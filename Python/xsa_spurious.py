@@ -1,23 +1,20 @@
-import pyvisa
-rm = pyvisa.ResourceManager()
+import numpy as np
+from xsa_common import open_xsa
+from xsa_file_io import read_file
 
 visaAddress = 'TCPIP0::141.121.37.90::hislip0::INSTR'
 
-xsa = rm.open_resource(visaAddress)
-xsa.timeout = 10000 # ms
+xsa = open_xsa(visaAddress, timeout=10000) # ms
 
 stateFile = r"D:\Users\Instrument\Documents\SA\state\spur_test.state"
 screenFile = r"D:\Users\Instrument\Documents\SA\screen\spurious_results.png"
 
-xsa.write(f':INST:CONF:SA:SANalyzer')
-xsa.query(f'*OPC?')
+xsa.query(f':INST:CONF:SA:SANalyzer;*OPC?')
 xsa.write(f'MMEMory:LOAD:STATe "{stateFile}"')
-xsa.write(f':CONF:SPURious:NDEF')
-xsa.query(f'*OPC?')
+xsa.query(f':CONF:SPURious:NDEF;*OPC?')
 xsa.write(f':INITiate:CONTinuous 0')
 xsa.write(f':INITiate:RESTart')
-xsa.write(f':MMEMory:STORe:SCReen "{screenFile}"')
-xsa.query(f'*OPC?')
+xsa.query(f':MMEMory:STORe:SCReen "{screenFile}";*OPC?')
 
 
 """Get and parse spurious results"""
@@ -26,33 +23,24 @@ xsa.query(f'*OPC?')
 rawResults = xsa.query(f':READ:SPURious?')
 
 # Parse the results
-results = [float(r) for r in rawResults.split(',')]
+results = np.array(rawResults.split(','), dtype=np.float64)
 # The first value is the number of spurs
 numSpurs = int(results[0])
 print(numSpurs)
 
 # The rest of the list is the spur data that we need to parse
-rawSpurData = results[1::]
-
-spurData = []
+rawSpurData = results[1:1 + numSpurs * 6]
 
 # There are 6 values per spur in the table
 # Spur number, spur range, spur frequency, spur amplitude, spur amplitude limit, delta from limit to spur amplitude
-# so we split the list into sub-lists of 6 values per spur
-for i in range(numSpurs):
-    startIndex = i * 6
-    stopIndex = startIndex + 6
-    spurData.append(rawSpurData[startIndex:stopIndex])
+# so we view the data as a table with one named record of 6 values per spur.
+# Columns can then be accessed by name, e.g. spurData['freq']
+spurDtype = np.dtype([('num', 'f8'), ('range', 'f8'), ('freq', 'f8'), ('amp', 'f8'), ('limit', 'f8'), ('delta', 'f8')])
+spurData = rawSpurData.view(spurDtype)
 
 print(spurData)
 
 """Transfer the screenshot to remote PC"""
 fileDestination = r"C:\Temp\spurious_results.png"
-# Transfer data from file on instrument hard drive as a list of raw bytes
-rawData = xsa.query_binary_values(f'mmemory:data? "{screenFile}"', datatype='c')
-# Join the raw data into a single bytes object
-data = b''.join(rawData)
-
-# Write file to remote PC file location as bytes
-with open(fileDestination, mode="wb") as f:
-            f.write(data)
\ No newline at end of file
+# Transfer file from instrument hard drive and write it to remote PC file location
+read_file(xsa, screenFile, fileDestination)
@@ -3,7 +3,7 @@
 # 
 # Sets up zero span in swept analyzer mode, configures a trigger that will capture
 # events with long time periods (much longer than the instrument's timeout),
-# and saves trace data to csv files
+# and saves trace data to csv (or NumPy .npy or raw binary) files
 # 
 # Obligatory warning that this software has not gone through
 # the standard Keysight software development process. It was
@@ -12,135 +12,347 @@
 # Python 3.9.x
 # PyVISA 1.12.x
 # Matplotlib 3.4.x
-# to get pyvisa and matplotlib, open windows command prompt and type:
+# NumPy 1.22.x
+# to get pyvisa, matplotlib, and numpy, open windows command prompt and type:
 # pip install pyvisa
 # pip install matplotlib
+# pip install numpy
 
 
-import csv
+import functools
+import json
+import os
 import pyvisa
-from datetime import datetime, timezone, timedelta
-from time import sleep
+from time import time, gmtime, strftime
+import queue
+import threading
 import matplotlib.pyplot as plt
+import numpy as np
+from xsa_common import open_xsa, close_xsa, run_parallel, write_batch, poll_until, save_worker
 
-def main():
-    """Establishes communication with X-series signal analyzer,
-    configures basic settings, acquires a trace, and saves data to csv."""
+# Measurement setup
+CF = 1.61625e9
+RBW = 3e6
+SWEEP_TIME = 5 # sec
+ATTEN = 20
 
-    # Create an instrument object with pyvisa and set the timeout
-    sa = pyvisa.ResourceManager().open_resource('TCPIP0::192.168.50.200::hislip0::INSTR')
-    sa.timeout = 5000 # ms
-    
-    # Now the spectrum analyzer object can be controlled by calling
+TRIG_DELAY = -100e-3
+TRIG_LEVEL = -20
+
+# Setup is sent as two compound messages rather than one write per setting
+# The commands are formatted once here rather than every time the setup is sent
+SETUP_CMDS = (
+    [
+        # Set up swept SA mode with default settings, then set cf, zero span, rbw, sweep time, and attenuation
+        ':INSTrument:SELect SA',
+        ':CONFigure:SANalyzer:NDEFault',
+        f':SENSe:FREQuency:CENTer {CF}',
+        ':SENSe:FREQuency:SPAN 0',
+        f':SENSe:BANDwidth:RESolution {RBW}',
+        f':SENSe:SWEep:TIME {SWEEP_TIME}',
+        f':SENSe:POWer:RF:ATTenuation {ATTEN}',
+    ],
+    [
+        # Set RF burst trigger
+        ':TRIGger:SEQuence:SOURce RFBurst',
+        ':TRIGger:SEQuence:RFBurst:LEVel:TYPE ABSolute',
+        f':TRIGger:SEQuence:RFBurst:LEVel:ABSolute {TRIG_LEVEL}',
+        f':TRIGger:SEQuence:RFBurst:DELay {TRIG_DELAY}',
+        ':TRIGger:SEQuence:RFBurst:DELay:STATe on',
+        # Make sure binary formatting for trace data is correct (data type and endianness)
+        ':FORMat:TRACe:DATA REAL,32',
+        ':FORMat:BORDer SWAPped',
+        # Switch to single sweep
+        ':INITiate:CONTinuous 0',
+    ],
+)
+
+# Single shot, start acquisition
+INIT_CMD = b':INITiate:SANalyzer\n'
+
+# status:operation:condition bits
+WAITING_FOR_TRIGGER = 1 << 5
+MEASURING = 1 << 4
+SWEEPING = 1 << 3
+
+# Status queries sent while waiting for an acquisition, encoded once here rather than on every poll
+# write_raw() doesn't add a termination character, so it's included
+COND_QUERY = b'status:operation:condition?\n'
+EVENT_QUERY = b':STATus:OPERation:EVENt?\n'
+
+# File format for saved traces
+# 'csv' saves text that can be opened anywhere, 'npy' saves the 32-bit float data as received
+# in NumPy's binary format, which is about 4x smaller and much faster to write. Load it with np.load()
+# 'bin' writes only the envelope data exactly as the instrument sent it, with the information needed
+# to read it back in a .json file of the same name. Load it with np.fromfile(fileName, dtype='<f4')
+SAVE_FORMAT = 'csv'
+
+# np.savetxt settings for the saved csv files
+CSV_OPTIONS = dict(delimiter=',', header='Time (sec),Envelope (dBm)', comments='', fmt='%.9g')
+
+
+# Parsed status query responses, see fast_int()
+_intCache = {}
+
+
+def fast_int(response):
+    """Converts a status query response (bytes) to an int.
+    The condition register only ever holds a handful of values, so each distinct
+    response is parsed once and looked up in a dict after that."""
+
+    value = _intCache.get(response)
+    if value is None:
+        value = _intCache.setdefault(response, int(response))
+    return value
+
+
+def enable_operation_srq(sa):
+    """Configures the status registers so that any change of the waiting for trigger,
+    measuring, or sweeping bits raises a service request, and enables VISA service request events."""
+
+    mask = WAITING_FOR_TRIGGER | MEASURING | SWEEPING
+    # *RST doesn't clear the operation event register, so bits latched by the sweeps after reset
+    # would raise the service request as soon as it's enabled. *CLS clears them first.
+    # Then latch both rising and falling edges of the bits into the operation event register
+    write_batch(sa, ['*CLS', f':STATus:OPERation:ENABle {mask}', f':STATus:OPERation:PTRansition {mask}',
+                     f':STATus:OPERation:NTRansition {mask}'])
+    # Enable VISA service request events before the instrument can raise one, so none are missed
+    sa.enable_event(pyvisa.constants.EventType.service_request, pyvisa.constants.EventMechanism.queue)
+    # Route the operation summary bit (bit 7 of the status byte) to the service request
+    sa.write('*SRE 128')
+
+
+def wait_for_start(sa, timeout=0.2, fallbackTimeout=2):
+    """Waits for the instrument to report that an acquisition has started by setting the
+    measuring, waiting for trigger, or sweeping bit.
+
+    If none of the bits are set within timeout (sec), prints a warning and keeps checking
+    for up to fallbackTimeout (sec) more, then raises TimeoutError. An idle instrument has
+    all of these bits cleared, which wait_for_acquisition() would otherwise mistake for a
+    finished acquisition and the previous trace would be saved again."""
+
+    writeRaw = sa.write_raw
+    readRaw = sa.read_raw
+
+    def started():
+        writeRaw(COND_QUERY)
+        return fast_int(readRaw()) & (MEASURING | WAITING_FOR_TRIGGER | SWEEPING)
+
+    try:
+        poll_until(started, initialDelay=0.002, maxDelay=0.002, timeout=timeout)
+    except TimeoutError:
+        print(f'Acquisition has not started after {timeout} sec, waiting up to {fallbackTimeout} sec longer')
+        try:
+            poll_until(started, initialDelay=0.01, maxDelay=0.1, timeout=fallbackTimeout)
+        except TimeoutError:
+            raise TimeoutError(f'Acquisition did not start within {timeout + fallbackTimeout} sec '
+                               f'of :INITiate:SANalyzer') from None
+
+
+def wait_for_acquisition(sa, useSrq=False, sweepTimeout=pyvisa.constants.VI_TMO_INFINITE,
+                         initialDelay=0.005, maxDelay=0.25):
+    """Waits for the instrument to receive a trigger and then finish sweeping, and returns
+    the time the trigger was seen in seconds since the epoch.
+
+    The waiting for trigger, measuring, and sweeping bits are checked in the same
+    status:operation:condition response, so each check is a single query.
+    The trigger is only recorded once the instrument has been seen waiting for a trigger or
+    sweeping, since the waiting for trigger bit is also clear while the acquisition is still
+    being set up (only the measuring bit set).
+    When polling, the delay between checks starts at initialDelay and grows by 1.5x up to
+    maxDelay (sec), see poll_until().
+    If useSrq is True, waits for a service request from enable_operation_srq() between
+    checks instead of polling. The wait for trigger has no timeout, since triggers can
+    be far apart. sweepTimeout (ms) applies to each wait after the trigger."""
+
+    # Look up the write and read methods once rather than on every poll
+    writeRaw = sa.write_raw
+    readRaw = sa.read_raw
+    triggerTime = None
+    armed = False
+
+    def acquisition_done():
+        nonlocal triggerTime, armed
+        writeRaw(COND_QUERY)
+        cond = fast_int(readRaw())
+
+        if cond & (WAITING_FOR_TRIGGER | SWEEPING):
+            armed = True
+
+        # The waiting for trigger bit goes LOW when the instrument receives a trigger
+        if triggerTime is None and armed and not cond & WAITING_FOR_TRIGGER:
+            triggerTime = time()
+
+        # After the instrument is triggered, it still needs to complete an acquisition,
+        # so the acquisition is done when both the sweeping and measuring bits turn off
+        return triggerTime is not None and not cond & (SWEEPING | MEASURING)
+
+    if useSrq:
+        while not acquisition_done():
+            timeout = pyvisa.constants.VI_TMO_INFINITE if triggerTime is None else sweepTimeout
+            sa.wait_on_event(pyvisa.constants.EventType.service_request, timeout)
+            # Serial polling the status byte clears the service request, and reading the operation
+            # event register clears the latched bits, so the next change raises a new service request
+            sa.read_stb()
+            writeRaw(EVENT_QUERY)
+            # A trigger and sweep that start and finish between two service requests never show
+            # up in the condition register, but their edges are still latched in the event register
+            if fast_int(readRaw()) & (WAITING_FOR_TRIGGER | SWEEPING):
+                armed = True
+    else:
+        poll_until(acquisition_done, initialDelay, maxDelay)
+
+    return triggerTime
+
+
+def save_trace(fileName, timeArray, envelope):
+    """Saves time and envelope trace data to a file in SAVE_FORMAT.
+    csv and npy files have time and envelope columns, bin files only have the envelope."""
+
+    if SAVE_FORMAT == 'bin':
+        # The envelope array is built directly on the bytes received from the instrument, so writing
+        # the array writes those bytes to disk without converting or copying any values
+        with open(fileName, 'wb') as f:
+            f.write(envelope)
+        # The time axis is evenly spaced, so its start and stop are enough to rebuild it
+        metadata = {'points': len(envelope), 'dtype': 'float32', 'byteorder': 'little',
+                    'units': 'dBm', 'startTime': float(timeArray[0]), 'stopTime': float(timeArray[-1])}
+        with open(os.path.splitext(fileName)[0] + '.json', 'w') as f:
+            json.dump(metadata, f)
+    elif SAVE_FORMAT == 'npy':
+        # Columns are time (sec) and envelope (dBm)
+        np.save(fileName, np.column_stack((timeArray, envelope)))
+    else:
+        # A 1 MB write buffer means the file is written in a few large writes rather than many small ones,
+        # and the ascii codec is the cheapest text encoding (the file only contains numbers)
+        with open(fileName, 'w', newline='\n', buffering=1 << 20, encoding='ascii') as f:
+            np.savetxt(f, np.column_stack((timeArray, envelope)), **CSV_OPTIONS)
+    print(f'Saved data at {fileName}')
+
+
+def run(sa, baseFileName='C:\\temp\\zero_span_trace_'):
+    """Configures basic settings on the X-series signal analyzer session sa,
+    acquires traces, and saves data to files.
+    The timestamp and file extension are appended to baseFileName for each saved file."""
+
+    # The spectrum analyzer object can be controlled by calling
     # .write(), .query(), .read(), etc. methods
 
     # Reset the instrument and wait for reset operation to complete
-    sa.write('*RST')
-    sa.query('*OPC?')
+    sa.query('*RST;*OPC?')
 
     # get instrument identifier
     instID = sa.query('*IDN?')
     # I'm using an f-string here, which uses {var} syntax to insert variables into strings
     print(f'Connected to {instID}')
 
-    # Measurement setup
-    cf = 1.61625e9
-    rbw = 3e6
-    sweepTime = 5 # sec
-    atten = 20
-
-    trigDelay = -100e-3
-    trigLevel = -20 
+    # Wait for trigger and sweep completion with service requests rather than polling
+    # Set to False if your VISA library doesn't support service request events
+    useSrq = True
 
     # Results setup
-    # The timestamp and ".csv" will be appended to each saved file
-    baseFileName = 'C:\\temp\\zero_span_trace_'
     numRepetitions = 20
 
-    # Set up a timezone-contextualized timestamp
-    # PDT is permanently GMT-7 hr: YYYYMMdd_hh-mm-ss
-    tz = timezone(offset=timedelta(hours=-7), name='pdt')
+    # Timestamps are in PDT, which is permanently GMT-7 hr: YYYYMMdd_hh-mm-ss
+    utcOffset = -7 * 3600 # sec
 
-    # Set up IQ Analyzer mode for a complex spectrum measurement
-    # The default shows both a spectrum trace and IQ vs time traces
-    sa.write(f':INSTrument:SELect SA')
-    sa.write(f':CONFigure:SANalyzer:NDEFault')
-    
-    # Set cf, rbw, sweep time, and attenuation
-    sa.write(f':SENSe:FREQuency:CENTer {cf}')
-    sa.write(f':SENSe:FREQuency:SPAN 0')
-    sa.write(f':SENSe:BANDwidth:RESolution {rbw}')
-    sa.write(f':SENSe:SWEep:TIME {sweepTime}')
-    sa.write(f':SENSe:POWer:RF:ATTenuation {atten}')
-
-    # Set RF burst trigger
-    sa.write(f':TRIGger:SEQuence:SOURce RFBurst')
-    sa.write(f':TRIGger:SEQuence:RFBurst:LEVel:TYPE ABSolute')
-    sa.write(f':TRIGger:SEQuence:RFBurst:LEVel:ABSolute {trigLevel}')
-    sa.write(f':TRIGger:SEQuence:RFBurst:DELay {trigDelay}')
-    sa.write(f':TRIGger:SEQuence:RFBurst:DELay:STATe on')
-
-    # Make sure binary formatting for trace data is correct (data type and endianness)
-    sa.write(':FORMat:TRACe:DATA REAL,32')
-    sa.write(':FORMat:BORDer SWAPped')
-
-    sa.write(':INITiate:CONTinuous 0')
+    # Send the measurement setup
+    for cmds in SETUP_CMDS:
+        write_batch(sa, cmds)
+
+    if useSrq:
+        enable_operation_srq(sa)
     
-    for i in range(numRepetitions):
-        # Single shot, start acquisition
-        sa.write(':INITiate:SANalyzer')
-        
-        # Poll the status:operation register to see if the instrument is waiting for trigger
-        # This bit will be HIGH while the instrument is waiting for a trigger
-        # It will go LOW when it receives a trigger AND when it is idle/not making a measurement
-        
-        # There is a delay between when the INITiate:SANalyzer command is sent and when the bit goes high
-        # So we add a delay in the code so that it doesn't immediately kick out of the while loop
-        sleep(1)
-        waitingForTrigger = 32
-        while waitingForTrigger != 0:
-            waitingForTrigger = int(sa.query('status:operation:condition?')) & (1 << 5)
-            sleep(0.01)
-            # print(f'waiting for trigger? {waitingForTrigger}')
-
-        # Once the instrument receives a trigger
-        # Get current time
-        rawTimestamp = datetime.now(tz)
-        # Convert datetime object to formatted string
-        timestamp = rawTimestamp.strftime('%Y%m%d_%H-%M-%S')
+    # Single shot, start the first acquisition
+    # Each following acquisition is started as soon as the previous trace has been fetched,
+    # so the instrument is arming and waiting for the next trigger while the previous trace is saved
+    sa.write_raw(INIT_CMD)
 
-        # After the instrument is triggered, it still needs to complete an acquisition,
-        # so poll the "sweeping" bit until it turns off, then get trace data
-        sweeping = 1
-        while sweeping:
-            sweeping = int(sa.query('status:operation:condition?')) & (1 << 3)
-            sleep(0.01)
-            print(f'sweeping? {sweeping}')
+    # Saving happens on a background writer thread so it doesn't hold up the next acquisition
+    # A single writer saves the files in order. The queue holds at most a few traces, so if saving
+    # falls behind, the acquisition loop waits rather than piling up traces in memory
+    saveQueue = queue.Queue(maxsize=4)
+    saveErrors = []
+    writer = threading.Thread(target=save_worker, args=(saveQueue, save_trace, saveErrors), daemon=True)
+    writer.start()
+
+    # The writer is always told to stop and waited for, even if an acquisition fails,
+    # so every trace that was already fetched is saved
+    try:
+        timeArray = None
+        for i in range(numRepetitions):
+            # Stop acquiring if saving has failed, since the remaining traces couldn't be saved either
+            if saveErrors:
+                break
+
+            # Poll the status:operation register to see if the instrument is waiting for trigger
+            # This bit will be HIGH while the instrument is waiting for a trigger
+            # It will go LOW when it receives a trigger AND when it is idle/not making a measurement
+
+            # There is a delay between when the INITiate:SANalyzer command is sent and when the bit goes high
+            # So we wait for the acquisition to start so that it doesn't immediately kick out of the while loop
+            wait_for_start(sa)
+            # Wait for the trigger and then for the sweep to finish, which should be well within twice the sweep time
+            triggerTime = wait_for_acquisition(sa, useSrq, sweepTimeout=SWEEP_TIME * 2 * 1000)
+
+            # Convert the time the instrument received a trigger to a formatted string
+            # Shifting the time by the UTC offset and formatting it as GMT gives the local time
+            timestamp = strftime('%Y%m%d_%H-%M-%S', gmtime(triggerTime + utcOffset))
 
-        # Wait for acquisition to complete after receiving the trigger
-        # This in addition to polling the "sweeping" bit is belt + suspenders
-        sa.query('*opc?')
+            # Grab envelope trace data (expecting 32-bit little endian floating point data, set by :FORMat:BORDer SWAPped)
+            # container=np.ndarray returns a NumPy array built directly on the received data rather than a list
+            # Only the envelope is transferred. The time values are evenly spaced across the sweep, so they're
+            # calculated on the host, which halves the amount of data sent by the instrument
+            envelope = sa.query_binary_values(':TRACe:DATA? TRACE1', datatype='f', container=np.ndarray)
+            # The number of trace points doesn't change between sweeps, so the time axis only needs to be calculated once
+            if timeArray is None or len(timeArray) != len(envelope):
+                timeArray = np.linspace(TRIG_DELAY, TRIG_DELAY + SWEEP_TIME, len(envelope), dtype=np.float32)
 
-        # Grab raw trace data (expecting 32-bit big endian floating point data)
-        raw = sa.query_binary_values(f':FETCH:SANalyzer1?', datatype='f')
-        timeArray = raw[0::2]
-        envelope = raw[1::2]
+            # Start the next acquisition now that the trace data is on the host
+            if i < numRepetitions - 1:
+                sa.write_raw(INIT_CMD)
+
+            # # Plot stuff
+            # plt.plot(timeArray, envelope)
+            # plt.show()
+
+            # Save trace data to a csv, npy, or bin file
+            fullFileName = f'{baseFileName}{timestamp}.{SAVE_FORMAT}'
+            saveQueue.put((fullFileName, timeArray, envelope))
+    finally:
+        # Tell the writer there are no more traces and wait for it to finish saving
+        saveQueue.put(None)
+        writer.join()
+
+    # Raise the first error that occurred while saving
+    if saveErrors:
+        raise saveErrors[0]
+
+
+def main():
+    """Runs the zero span captures on a single analyzer."""
 
-        # # Plot stuff
-        # plt.plot(timeArray, envelope)
-        # plt.show()
+    # Create an instrument object and set the timeout
+    visaAddress = 'TCPIP0::192.168.50.200::hislip0::INSTR'
+    sa = open_xsa(visaAddress, timeout=5000) # ms
+    try:
+        run(sa)
+    finally:
+        close_xsa(visaAddress)
 
-        # Save trace data to csv file
-        fullFileName = f'{baseFileName}{timestamp}.csv'
 
-        print(f'Saved data at {fullFileName}')
+def main_parallel(addresses):
+    """Runs the zero span captures on several analyzers at the same time.
+    run_parallel() runs each analyzer on its own thread, so an analyzer waiting for a trigger
+    doesn't hold up the others, and closes each session when its captures are done.
+    Each analyzer's files are named with its index in addresses."""
 
-        with open(fullFileName, 'w', newline='\n') as f:
-            writer = csv.writer(f, dialect='excel', delimiter=',', )
-            writer.writerow(['Time (sec)', 'Envelope (dBm)'])
-            for t, e in zip(timeArray, envelope):
-                writer.writerow([t, e])
+    tasks = [(address, functools.partial(run, baseFileName=f'C:\\temp\\zero_span_trace_{i}_'))
+             for i, address in enumerate(addresses)]
+    run_parallel(tasks, timeout=5000) # ms
 
 
 if __name__ == '__main__':
     main()
+    # To capture from several analyzers at once, use this instead
+    # main_parallel(['TCPIP0::192.168.50.200::hislip0::INSTR', 'TCPIP0::192.168.50.201::hislip0::INSTR'])